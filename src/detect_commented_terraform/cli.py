@@ -1,25 +1,73 @@
+import os
 import re
 import sys
+import json
+import mmap
+import time
+import hashlib
+import functools
+import contextlib
+import importlib.metadata
 from typing import List
+from typing import Iterator
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
 
 import typer
 from loguru import logger
+from rich.text import Text
 from rich.console import Console
 
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
 app = typer.Typer(help="Detect commented-out Terraform code in .tf files.")
 
+# Terraform block types recognised in commented-out code
+_BLOCK_TYPES = r"resource|variable|output|module|provider|data|locals|terraform"
+
+# Patterns are compiled once at import time; they run for every line of every scanned file
+# A comment containing a block keyword, or a # comment holding an assignment or brace
+_COMMENTED_LINE_RE = re.compile(
+    rf"^\s*(?:(?:#|//|/\*).*\b(?:{_BLOCK_TYPES})\b|#.*\b\w+\s*=\s*.+|#.*[{{}}])"
+)
+
+# Bytes patterns run over a whole memory-mapped file, so whitespace runs must not cross newlines
+# Every line that can change scan state, classified by named group in a single pass:
+# single/start/end are # block lines, open is a line starting /*, close any other line with */
+_EVENT_RE = re.compile(
+    (
+        r"(?m)^(?:[^\S\n]*(?:"
+        r"\#[^\S\n]*(?:"
+        # Anchoring on the first { keeps this linear; two .* runs backtrack quadratically
+        rf"(?P<single>(?:{_BLOCK_TYPES})\b[^{{\n]*\{{.*\}})"
+        rf"|(?P<start>(?:{_BLOCK_TYPES})\b.*\{{)"
+        r"|(?P<end>\})"
+        r")[^\S\n]*$"
+        r"|(?P<open>/\*.*$)"
+        r")"
+        r"|(?P<close>.*\*/))"
+    ).encode()
+)
+# Terraform inside a /* ... */ comment: a block keyword anywhere, or a line that
+# is_commented_terraform_line accepts, searched in one pass over the comment's span
+_BLOCK_COMMENT_TF_RE = re.compile(
+    rf"(?m)\b(?:{_BLOCK_TYPES})\b|^[^\S\n]*#.*(?:\b\w+[^\S\n]*=[^\S\n]*.+|[{{}}])".encode()
+)
+
 
 def is_commented_terraform_line(line: str) -> bool:
     """
     Returns True if the line is a commented-out Terraform code line.
     Matches lines that start with #, //, or /* and contain a Terraform keyword or property pattern.
     """
-    keywords = r"(resource|variable|output|module|provider|data|locals|terraform)"
-    property_pattern = r"(\s*#.*\b\w+\s*=\s*.+|\s*#.*[{}])"
-    return bool(
-        re.match(r"^\s*(#|//|/\*).*\b" + keywords + r"\b", line) or re.match(property_pattern, line)
-    )
+    # Most lines are not comments at all; skip the regex for them
+    stripped = line.lstrip()
+    if not stripped or stripped[0] not in "#/":
+        return False
+    return _COMMENTED_LINE_RE.match(line) is not None
 
 
 def find_commented_terraform_blocks(lines: List[str]) -> list[tuple[int, int]]:
@@ -28,97 +76,316 @@ def find_commented_terraform_blocks(lines: List[str]) -> list[tuple[int, int]]:
     Detects blocks for resource, variable, output, module, provider, data, locals, terraform.
     Also detects single-line commented-out blocks (e.g., # data ... {}).
     """
+    # The same event pattern scan_file uses, so both always agree on what a block is
+    data = "\n".join(line.rstrip("\n") for line in lines).encode()
     blocks = []
-    in_block = False
     block_start = None
-    # Regex for all Terraform block types
-    block_types = r"resource|variable|output|module|provider|data|locals|terraform"
-    block_start_re = re.compile(rf"^\s*#\s*({block_types})\b.*\{{\s*$")
-    single_line_block_re = re.compile(rf"^\s*#\s*({block_types})\b.*\{{.*}}\s*$")
-    for i, line in enumerate(lines):
-        if single_line_block_re.match(line):
-            blocks.append((i, i))
-        elif block_start_re.match(line):
-            in_block = True
-            block_start = i
-        elif in_block and re.match(r"^\s*#\s*}\s*$", line):
-            if block_start is not None:  # Ensure block_start is not None
-                blocks.append((block_start, i))
-            in_block = False
+    lineno = 0
+    pos = 0
+    for m in _EVENT_RE.finditer(data):
+        lineno += data.count(b"\n", pos, m.start())
+        pos = m.start()
+        event = m.lastgroup
+        if event == "single":
+            blocks.append((lineno, lineno))
+        elif event == "start":
+            block_start = lineno
+        elif event == "end" and block_start is not None:
+            blocks.append((block_start, lineno))
             block_start = None
     return blocks
 
 
+# Directories that never hold user-authored Terraform (VCS data, vendored modules, tooling)
+_SKIP_DIRS = frozenset({".git", ".terraform", "node_modules", ".venv", "__pycache__"})
+
+
+def _iter_tf_files(root: str) -> Iterator[str]:
+    """Yield paths of .tf files under root, without descending into _SKIP_DIRS."""
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            with os.scandir(directory) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.name not in _SKIP_DIRS:
+                            stack.append(entry.path)
+                    elif entry.name.endswith(".tf"):
+                        yield entry.path
+        except OSError as e:
+            logger.warning(f"Cannot read directory {directory}: {e}")
+
+
+def _decode_line(line: bytes) -> str:
+    """Decode a matched line for display, tolerating files that are not valid UTF-8."""
+    return line.rstrip().decode("utf-8", errors="replace")
+
+
+def _block_warning(file: str, start: int, end: int, first_line: str, last_line: str) -> dict:
+    """Build the warning dict for a commented-out # block spanning lines start..end (1-based)."""
+    return {
+        "file": file,
+        "line_range": (start, end),
+        "block_start": start,
+        "block_end": end,
+        "block_first_line": first_line,
+        "block_last_line": last_line,
+        "line_content": f"{first_line} ... {last_line}",
+    }
+
+
+@functools.cache
+def _find_repo_root(directory: Path) -> Path | None:
+    """
+    Returns the nearest directory at or above directory that contains .git, or None.
+    Cached per directory, so files sharing parents cost one .git check per directory per run.
+    """
+    if (directory / ".git").exists():
+        return directory
+    parent = directory.parent
+    if parent == directory:
+        return None
+    return _find_repo_root(parent)
+
+
 def scan_file(filepath: Path, repo_root: Path | None = None) -> list[dict]:
     """
     Scan a file for commented-out Terraform code. Returns a list of warning dicts.
     Only detects entire commented-out blocks, not single lines.
     """
-    warnings: list[dict] = []
     if repo_root is None:
         # Try to find the repo root (directory containing .git or project root)
-        repo_root = Path.cwd()
-        for parent in filepath.parents:
-            if (parent / ".git").exists():
-                repo_root = parent
-                break
-    rel_path = filepath.relative_to(repo_root)
+        filepath = filepath.absolute()
+        repo_root = _find_repo_root(filepath.parent) or Path.cwd()
     try:
-        with open(filepath, encoding="utf-8") as f:
-            lines = f.readlines()
-    except Exception as e:
+        rel_path = filepath.relative_to(repo_root)
+    except ValueError:
+        # Files outside the repo (or the working directory) are reported by their full path
+        rel_path = filepath
+    try:
+        with open(filepath, "rb") as f:
+            # mmap refuses empty files, and there is nothing to scan in them anyway
+            if os.fstat(f.fileno()).st_size == 0:
+                return []
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                return _scan_buffer(data, str(rel_path))
+    except OSError as e:
         logger.warning(f"Error reading {filepath}: {e}")
-        return warnings
-    # Only block detection (ignore single lines)
-    for block_start, block_end in find_commented_terraform_blocks(lines):
-        warnings.append(
-            {
-                "file": str(rel_path),
-                "line_range": (block_start + 1, block_end + 1),
-                "block_start": block_start + 1,
-                "block_end": block_end + 1,
-                "block_first_line": lines[block_start].rstrip(),
-                "block_last_line": lines[block_end].rstrip(),
-                "line_content": f"{lines[block_start].rstrip()} ... {lines[block_end].rstrip()}",
-            }
-        )
-    # Optionally, keep multi-line /* ... */ block detection if desired
+        return []
+
+
+def _scan_buffer(data: mmap.mmap, file: str) -> list[dict]:
+    """
+    Find commented-out # blocks and Terraform inside /* ... */ comments in a file's raw bytes.
+    Only the matched lines are decoded, for the warning output.
+    """
+    # Without any comment marker there is nothing to find; find() runs at memchr speed
+    if data.find(b"#") == -1 and data.find(b"/*") == -1:
+        return []
+    warnings: list[dict] = []
+    # Commented-out # blocks
+    in_hash_block = False
+    hash_block_start = 0
+    hash_block_first_line = ""
+    # Multi-line /* ... */ block comments
     in_block_comment = False
-    block_comment_lines = []
-    for lineno, line in enumerate(lines, 1):
-        stripped = line.strip()
-        if stripped.startswith("/*"):
+    block_comment_start = 0
+    block_comment_pos = 0
+    block_comment_first_line = ""
+    lineno = 1
+    pos = 0
+    for m in _EVENT_RE.finditer(data):
+        event = m.lastgroup
+        match_pos = m.start()
+        lineno += data[pos:match_pos].count(b"\n")
+        pos = match_pos
+        line = m.group()
+        if event == "open":
+            stripped = line.strip()
             in_block_comment = True
-            block_comment_lines = [(lineno, line)]
-            if stripped.endswith("*/") and len(stripped) > 4:
+            block_comment_start = lineno
+            block_comment_pos = match_pos
+            block_comment_first_line = _decode_line(line)
+            if stripped.endswith(b"*/") and len(stripped) > 4:
                 in_block_comment = False
-                block_comment_lines.append((lineno, line))
-        elif in_block_comment:
-            block_comment_lines.append((lineno, line))
-            if "*/" in stripped:
-                if any(
-                    is_commented_terraform_line(L)
-                    or re.search(
-                        r"\b(resource|variable|output|module|provider|data|locals|terraform)\b",
-                        L,
-                    )
-                    for _, L in block_comment_lines
-                ):
-                    first_lineno, first_line = block_comment_lines[0]
-                    warnings.append(
-                        {
-                            "file": str(rel_path),
-                            "line": first_lineno,
-                            "block_start": first_lineno,
-                            "block_first_line": first_line.rstrip(),
-                            "line_content": "/* ... */ block comment",
-                        }
-                    )
-                in_block_comment = False
-                block_comment_lines = []
+            continue
+        if event == "single":
+            first_line = _decode_line(line)
+            warnings.append(_block_warning(file, lineno, lineno, first_line, first_line))
+        elif event == "start":
+            in_hash_block = True
+            hash_block_start = lineno
+            hash_block_first_line = _decode_line(line)
+        elif event == "end" and in_hash_block:
+            warnings.append(
+                _block_warning(
+                    file, hash_block_start, lineno, hash_block_first_line, _decode_line(line)
+                )
+            )
+            in_hash_block = False
+        # A # block line is matched whole, so check it for a */ closing the block comment too
+        if in_block_comment and (event == "close" or b"*/" in line):
+            block_end_pos = data.find(b"\n", match_pos)
+            if block_end_pos == -1:
+                block_end_pos = len(data)
+            if _BLOCK_COMMENT_TF_RE.search(data, block_comment_pos, block_end_pos):
+                warnings.append(
+                    {
+                        "file": file,
+                        "line": block_comment_start,
+                        "block_start": block_comment_start,
+                        "block_first_line": block_comment_first_line,
+                        "line_content": "/* ... */ block comment",
+                    }
+                )
+            in_block_comment = False
     return warnings
 
 
+# Part of the cache key alongside the installed package version; bump for format changes
+_CACHE_VERSION = 3
+# Files modified this recently may change again without their mtime moving; don't cache them
+_RACY_WINDOW_NS = 2_000_000_000
+# Below this many files to scan, process pool startup costs more than it saves
+_PARALLEL_MIN_FILES = 64
+
+
+@functools.cache
+def _cache_key() -> str | None:
+    """
+    Key stored with cached results, so any release (or format change) invalidates them.
+    Returns None when the package metadata is unavailable, which disables the cache.
+    """
+    try:
+        version = importlib.metadata.version("detect-commented-terraform")
+    except importlib.metadata.PackageNotFoundError:
+        return None
+    return f"{_CACHE_VERSION}:{version}"
+
+
+def _cache_path(cwd: str) -> Path:
+    """
+    Location of the scan cache for runs from cwd, honouring XDG_CACHE_HOME.
+    One file per working directory, as reported paths are relative to it for files outside a repo.
+    """
+    cache_home = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    name = hashlib.sha256(cwd.encode("utf-8", "surrogateescape")).hexdigest()[:16]
+    return Path(cache_home) / "detect_commented_terraform" / f"{name}.json"
+
+
+def _load_cache(path: Path, key: str) -> dict:
+    """Load cached scan results keyed by file path. Returns an empty cache on any problem."""
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(data, dict) or data.get("key") != key:
+        return {}
+    files = data.get("files")
+    return files if isinstance(files, dict) else {}
+
+
+def _save_cache(path: Path, key: str, cache: dict) -> None:
+    """Persist the scan cache, replacing the file atomically so concurrent runs never tear it."""
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"key": key, "files": cache}, f)
+        os.replace(tmp, path)
+    except OSError as e:
+        logger.debug(f"Could not write scan cache {path}: {e}")
+
+
+def _scan_files(tf_files: set[Path]) -> dict[Path, list[dict]]:
+    """
+    Scan the given files, returning their warnings keyed by path.
+    Unchanged files are served from the on-disk cache; the rest are scanned in a process pool
+    when there are enough of them to outweigh the pool's startup cost.
+    New results are merged into the cache, which is rewritten only when they change it.
+    """
+    if not tf_files:
+        return {}
+    key = _cache_key()
+    cwd = os.getcwd()
+    cache_path = _cache_path(cwd)
+    cache = _load_cache(cache_path, key) if key else {}
+    results: dict[Path, list[dict]] = {}
+    to_scan: list[tuple[Path, list]] = []
+    for file in tf_files:
+        try:
+            st = file.stat()
+        except OSError as e:
+            logger.error(f"Failed to scan {file}: {e}")
+            continue
+        signature = [st.st_mtime_ns, st.st_size]
+        entry = cache.get(str(file))
+        if isinstance(entry, dict) and entry.get("signature") == signature:
+            results[file] = entry["warnings"]
+        else:
+            to_scan.append((file, signature))
+
+    paths = [file for file, _ in to_scan]
+    if len(paths) < _PARALLEL_MIN_FILES or (os.cpu_count() or 1) < 2:
+        scanned = list(map(scan_file, paths))
+    else:
+        with ProcessPoolExecutor() as executor:
+            scanned = list(executor.map(scan_file, paths, chunksize=8))
+
+    # New entries to store, or None to drop a stale entry for a file still in its racy window
+    updates: dict[str, dict | None] = {}
+    now_ns = time.time_ns()
+    for (file, signature), warnings in zip(to_scan, scanned):
+        results[file] = warnings
+        if now_ns - signature[0] > _RACY_WINDOW_NS:
+            updates[str(file)] = {"signature": signature, "warnings": warnings}
+        elif str(file) in cache:
+            updates[str(file)] = None
+    if key and updates:
+        _update_cache(cache_path, key, updates)
+    return results
+
+
+def _update_cache(path: Path, key: str, updates: dict[str, dict | None]) -> None:
+    """
+    Merge updates into the on-disk cache, dropping entries for files that no longer exist.
+    The cache is re-read first, so entries written meanwhile by concurrent runs (pre-commit
+    scans batches of files in parallel) are kept rather than overwritten.
+    """
+    with _cache_lock(path):
+        cache = _load_cache(path, key)
+        for file, entry in updates.items():
+            if entry is None:
+                cache.pop(file, None)
+            else:
+                cache[file] = entry
+        cache = {file: entry for file, entry in cache.items() if os.path.exists(file)}
+        _save_cache(path, key, cache)
+
+
+@contextlib.contextmanager
+def _cache_lock(path: Path) -> Iterator[None]:
+    """
+    Hold an exclusive lock on a file next to the cache while it is read, merged and replaced.
+    Locking is best effort: without fcntl (Windows) or a writable cache directory, runs go unlocked.
+    """
+    if fcntl is None:
+        yield
+        return
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        lock_file = open(path.with_name(f"{path.name}.lock"), "w")
+    except OSError as e:
+        logger.debug(f"Could not lock scan cache {path}: {e}")
+        yield
+        return
+    with lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+
+
 def main(
     files: list[str] | None = None
 ) -> None:
@@ -131,30 +398,44 @@ def main(
     logger.add(sys.stderr, level="WARNING")  # Only show warnings/errors by default
     # Fix: Typer passes files=None if not provided, or a list if provided
     if files is None:
-        tf_files = {str(p.resolve()) for p in Path.cwd().rglob("*.tf")}
+        # The walk starts from the absolute working directory, so its paths are already absolute
+        tf_files = {Path(p) for p in _iter_tf_files(os.getcwd())}
     else:
-        tf_files = {str(Path(f).resolve()) for f in files if isinstance(f, str) and f.endswith(".tf")}
+        # abspath normalises without resolve()'s per-component symlink lookups
+        tf_files = {
+            Path(os.path.abspath(f)) for f in files if isinstance(f, str) and f.endswith(".tf")
+        }
+    # Pre-commit and CI capture output, where styling is dropped anyway; skip Rich entirely there
+    plain_output = not console.is_terminal
     found = False
     already_reported = set()
-    for file_path in tf_files:
-        file = Path(file_path)
-        try:
-            warnings = scan_file(file)
-        except OSError as e:
-            logger.error(f"Failed to scan {file}: {e}")
-            continue
+    for warnings in _scan_files(tf_files).values():
         for w in warnings:
             if "line_range" in w:
                 key = (w["file"], w["block_start"], w["block_end"])
                 if key in already_reported:
                     continue
                 already_reported.add(key)
-                console.print(
-                    f"[bold red]Commented-out Terraform block detected[/bold red] in "
-                    f"[bold yellow]{w['file']}[/bold yellow] at lines [bold cyan]{w['block_start']} - {w['block_end']}[/bold cyan]:\n"
-                    f"    [dim]{w['block_first_line']} ... {w['block_last_line']}[/dim]",
-                    markup=True,
-                )
+                line_range = f"{w['block_start']} - {w['block_end']}"
+                snippet = f"{w['block_first_line']} ... {w['block_last_line']}"
+                if plain_output:
+                    print(
+                        f"Commented-out Terraform block detected in {w['file']} "
+                        f"at lines {line_range}:\n    {snippet}"
+                    )
+                else:
+                    # Assembled from styled parts so brackets in the code aren't read as markup
+                    console.print(
+                        Text.assemble(
+                            ("Commented-out Terraform block detected", "bold red"),
+                            " in ",
+                            (w["file"], "bold yellow"),
+                            " at lines ",
+                            (line_range, "bold cyan"),
+                            ":\n    ",
+                            (snippet, "dim"),
+                        )
+                    )
                 found = True
     if found:
         raise typer.Exit(code=1)
@@ -0,0 +1,72 @@
+import os
+import sys
+import shutil
+import tempfile
+import compileall
+
+import pytest
+
+import detect_commented_terraform
+
+# Per-run tmpfs basetemp created by pytest_configure, removed again in pytest_unconfigure
+_shm_basetemp = None
+
+
+def pytest_configure(config):
+    """
+    On Linux CI runners, put pytest's temporary directories on tmpfs.
+    Each run gets its own private directory, so concurrent runs on one host can't wipe each
+    other's files; local runs keep pytest's default per-user basetemp and its retention.
+    """
+    global _shm_basetemp
+    if config.option.basetemp or not os.environ.get("CI"):
+        return
+    if sys.platform == "linux" and os.path.isdir("/dev/shm"):
+        _shm_basetemp = tempfile.mkdtemp(prefix="pytest-", dir="/dev/shm")
+        config.option.basetemp = _shm_basetemp
+
+
+def pytest_unconfigure(config):
+    """Free the tmpfs basetemp, which would otherwise hold memory until the runner reboots."""
+    if _shm_basetemp is not None:
+        shutil.rmtree(_shm_basetemp, ignore_errors=True)
+
+
+def pytest_sessionstart(session):
+    """Byte-compile the package once so spawned CLI processes start from cached bytecode."""
+    compileall.compile_dir(os.path.dirname(detect_commented_terraform.__file__), quiet=1)
+
+
+@pytest.fixture(scope="session")
+def _tmp_root(tmp_path_factory):
+    """One temporary directory shared by the whole session."""
+    return tmp_path_factory.mktemp("tf")
+
+
+@pytest.fixture(scope="session")
+def _dir_pool(_tmp_root):
+    """A fixed pool of scratch directories, created once and reused by every test."""
+    pool = [_tmp_root / f"d{i}" for i in range(16)]
+    for path in pool:
+        path.mkdir()
+    return pool
+
+
+@pytest.fixture
+def tf_dir(_dir_pool, request):
+    """An empty directory from the pool, picked by test id and cleared before use."""
+    path = _dir_pool[hash(request.node.nodeid) % len(_dir_pool)]
+    # Tests may leave subdirectories behind, and the CLI walks the tree, so start from scratch
+    shutil.rmtree(path)
+    path.mkdir()
+    return path
+
+
+@pytest.fixture(autouse=True)
+def _isolated_scan_cache(tmp_path_factory, monkeypatch):
+    """
+    Give each test an empty scan cache of its own, outside the user's home directory.
+    Pooled tf_dirs are shared between tests, so a shared cache could serve one test's results
+    to another; the cache lives outside the pool, where the CLI never walks.
+    """
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path_factory.mktemp("cache")))